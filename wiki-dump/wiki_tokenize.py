@@ -1,10 +1,12 @@
 import bz2
-import xml.etree.ElementTree as ET
+from lxml import etree as ET
 import re
-import json
 import os
 import io
-import array
+import numpy as np
+import orjson
+import xxhash
+from multiprocessing import Pool
 from dotenv import load_dotenv
 load_dotenv()
 # ======================
@@ -15,132 +17,352 @@ XML_PATH = os.getenv("XML_PATH", "wiki-dump/enwiki-20260101-pages-articles-multi
 INDEX_PATH = os.getenv("INDEX_PATH", "wiki-dump/enwiki-20260101-pages-articles-multistream-index.txt.bz2")
 TOKENS_FILE = os.getenv("TOKENS_FILE", "wiki-dump/tokens.bin")
 TOKENIZE_CHECKPOINT = os.getenv("TOKENIZE_CHECKPOINT", "wiki-dump/tokenize_checkpoint.json")
+HASHES_FILE = os.getenv("HASHES_FILE", "wiki-dump/tokens_hashes.bin")
+# Token cache + hash sidecar of a previous dump (optional). Articles whose raw
+# text is unchanged are copied from there instead of being cleaned again.
+PREV_TOKENS_FILE = os.getenv("PREV_TOKENS_FILE")
+PREV_HASHES_FILE = os.getenv("PREV_HASHES_FILE")
 
-EOS_TOKEN = 256
-MIN_ARTICLE_CHARS = 200
+# Opt-in: strip nested {{...}} templates whole (needs the `regex` module).
+# Slower than the default flat pattern, and changes the cleaned output.
+RECURSIVE_TEMPLATES = os.getenv("RECURSIVE_TEMPLATES") == "1"
 
-# Pre-compile Regex for speed
-RE_TEMPLATE = re.compile(r"\{\{.*?\}\}", flags=re.DOTALL)
-RE_REF = re.compile(r"<ref.*?>.*?</ref>", flags=re.DOTALL)
-RE_TAGS = re.compile(r"<.*?>")
-RE_LINKS = re.compile(r"\[\[|\]\]")
-RE_NEWLINES = re.compile(r"\n{2,}")
+EOS_TOKEN = 0xFF # Never a valid UTF-8 byte, so it cannot collide with text
+MIN_ARTICLE_BYTES = 200
+NUM_WORKERS = int(os.getenv("NUM_WORKERS", os.cpu_count() or 1))
+# Coalesce block payloads into large sequential writes. A kill mid-flush can
+# leave a torn block in tokens.bin; resume truncates back to the checkpoint.
+WRITE_BUFFER_SIZE = 64 << 20
+IMAP_CHUNKSIZE = 4 # Consecutive blocks handed to a worker at once
+PREFETCH_DISTANCE = NUM_WORKERS * IMAP_CHUNKSIZE # Blocks ahead to hint to the kernel
+# One sidecar record per article: xxh3_64 of the raw wikitext, and where its
+# cleaned bytes (without EOS) sit in the token file
+HASH_DTYPE = np.dtype([("h", "<u8"), ("off", "<u8"), ("len", "<u4")])
+# Every sidecar starts with this header. While building it is a log
+# (HASH_LOG_MAGIC, records appended in dump order); once complete it is an
+# index (HASH_INDEX_MAGIC, columns sorted by hash: h[count], off[count],
+# len[count]) so the keys are one contiguous array
+HASH_HEADER_DTYPE = np.dtype([("magic", "S8"), ("cleaner", "<u8"), ("count", "<u8")])
+HASH_LOG_MAGIC = b"TLMHLOG1"
+HASH_INDEX_MAGIC = b"TLMHIDX1"
+CLEANER_VERSION = 1 # Bump whenever clean_wikitext output changes beyond its patterns
+
+# Pre-compile Regex for speed.
+# Patterns run on raw UTF-8 bytes: every structural character ({, }, <, >,
+# [, ], \n) is ASCII, so multibyte sequences are copied through untouched.
+# Templates, refs, tags and link brackets are fused into one alternation so
+# the markup is stripped in a single left-to-right scan. The engine is picked
+# by config only, never by what happens to be installed, so the same settings
+# always produce the same tokens.bin.
+RE_REF = rb"<ref\b[^>]*(?<!/)>.*?</ref>" # Self-closing <ref .../> is a plain tag
+RE_TAGS = rb"<[^>\n]*>"
+RE_LINKS = rb"\[\[|\]\]"
+if RECURSIVE_TEMPLATES:
+    import regex # Required when opted in; no silent fallback
+    RE_TEMPLATE = rb"(\{\{(?:[^{}]++|\{(?!\{)|\}(?!\})|(?1))*+\}\})"
+    RE_MARKUP = regex.compile(b"|".join((RE_TEMPLATE, RE_REF, RE_TAGS, RE_LINKS)), flags=regex.DOTALL)
+else:
+    RE_TEMPLATE = rb"\{\{.*?\}\}"
+    RE_MARKUP = re.compile(b"|".join((RE_TEMPLATE, RE_REF, RE_TAGS, RE_LINKS)), flags=re.DOTALL)
+RE_NEWLINES = re.compile(rb"\n{2,}")
 
 # ======================
 # MULTISTREAM INDEX
 # ======================
 
-def load_multistream_index(index_path: str) -> list[int]:
-    offsets = set() # Use set to dedup, as index contains multiple lines per block
+def load_multistream_index(index_path: str) -> np.ndarray:
     print("[-] Loading index...")
-    with bz2.open(index_path, "rt", encoding="utf-8") as f:
-        for line in f:
-            if line:
-                # Format: byte_offset:page_id:title
-                offsets.add(int(line.split(":", 1)[0]))
-    return sorted(list(offsets))
+    with bz2.open(index_path, "rb") as f:
+        # Format: byte_offset:page_id:title
+        offsets = np.fromiter((int(line.split(b":", 1)[0]) for line in f if line.strip()), dtype=np.int64)
+    # Sorted and deduped, as the index contains multiple lines per block
+    return np.unique(offsets)
+
+def block_for_offset(offsets: np.ndarray, file_offset: int) -> int:
+    # Index of the block containing the given compressed byte offset
+    return int(np.searchsorted(offsets, file_offset, side="right")) - 1
 
 # ======================
 # XML STREAM
 # ======================
 
-def stream_pages_multistream(xml_path: str, offsets: list[int], start_block: int):
-    with open(xml_path, "rb") as f:
-        # Checkpoint logic: Only process from start_block + 1 to avoid duplicates on resume
-        # or rely on the user to handle the partially written block.
-        # Here we assume we restart at the exact block start.
-        
-        for block_idx in range(start_block, len(offsets)):
-            f.seek(offsets[block_idx])
-            
-            # Decompress entire block
-            decompressor = bz2.BZ2Decompressor()
-            data = bytearray()
-            
-            # Read until end of BZ2 stream (one block)
-            while not decompressor.eof:
-                chunk = f.read(65536)
-                if not chunk: break
-                try:
-                    data.extend(decompressor.decompress(chunk))
-                except OSError:
-                    break # Handle potential stream corruption gracefully
-
-            # Wrap simply for ElementTree
-            wrapped = b"<mediawiki>" + data + b"</mediawiki>"
-            
-            try:
-                # iterparse is safer for memory, even on blocks
-                context = ET.iterparse(io.BytesIO(wrapped), events=("end",))
-                for _, elem in context:
-                    if elem.tag.endswith("page"):
-                        yield elem
-                        elem.clear() 
-            except ET.ParseError:
-                pass # Skip malformed blocks
-            
-            # Yield End of Block signal
-            yield None 
+def read_block(f, offset: int, end: int | None) -> tuple[bytearray, bool]:
+    # The index gives the start of the next block, so the whole compressed
+    # stream is read in one call (end=None reads the last block to EOF)
+    f.seek(offset)
+    raw = memoryview(f.read(-1 if end is None else end - offset))
+    
+    # Decompress entire block. The decompressor stops at the end of the
+    # first bz2 stream, so the trailing </mediawiki> stream is ignored.
+    # It is fed in slices so that output produced before a corrupt spot
+    # survives: pages decoded up to there are still parsed. The flag tells
+    # whether the stream was decoded to its end or was cut short.
+    decompressor = bz2.BZ2Decompressor()
+    data = bytearray()
+    for start in range(0, len(raw), 65536):
+        try:
+            data += decompressor.decompress(raw[start:start + 65536])
+        except OSError:
+            break # Handle potential stream corruption gracefully
+        if decompressor.eof:
+            break
+    return data, decompressor.eof
+
+def stream_pages(data: bytearray, complete: bool = True):
+    # Wrap simply for ElementTree
+    wrapped = b"<mediawiki>" + data + b"</mediawiki>"
+    
+    try:
+        # iterparse is safer for memory, even on blocks.
+        # lxml filters on the tag in C, so only <page> ends reach Python.
+        context = ET.iterparse(
+            io.BytesIO(wrapped), events=("end",), tag="{*}page",
+            huge_tree=True, recover=True
+        )
+        # Each page is held back until the next one ends. In recover mode
+        # lxml still ends a page that was cut mid-way, so when the block was
+        # truncated the last page is dropped instead of emitted half-done.
+        held = None
+        for _, elem in context:
+            if held is not None:
+                yield held
+                free_page(held)
+            held = elem
+        if held is not None and complete:
+            yield held
+            free_page(held)
+    except ET.ParseError:
+        pass # Skip malformed blocks
+
+def free_page(elem):
+    # Free the page and the already processed siblings
+    elem.clear(keep_tail=True)
+    while elem.getprevious() is not None:
+        del elem.getparent()[0]
 
 # ======================
 # PARSING & CLEANING
 # ======================
 
 def parse_page(page):
-    def get(tag):
-        el = page.find(tag)
-        return el.text if el is not None else ""
-
+    # Cheap metadata only. The text is fetched separately by page_text, so
+    # pages rejected on these fields never have their text serialized.
     return {
-        "title": get("./title"),
-        "ns": int(get("./ns") or -1),
-        "redirect": page.find("./redirect") is not None,
-        "text": page.find(".//text").text or ""
+        "title": page.findtext("title", ""),
+        "ns": int(page.findtext("ns") or -1),
+        "redirect": page.find("redirect") is not None
     }
 
 def is_valid_article(p) -> bool:
     return (
         p["ns"] == 0 and
         not p["redirect"] and
-        not p["title"].lower().startswith("list of") and
-        len(p["text"]) >= MIN_ARTICLE_CHARS
+        not p["title"].lower().startswith("list of")
     )
 
-def clean_wikitext(text: str) -> str:
-    # Use pre-compiled regex
-    text = RE_TEMPLATE.sub("", text)
-    text = RE_REF.sub("", text)
-    text = RE_TAGS.sub("", text)
-    text = RE_LINKS.sub("", text)
-    text = RE_NEWLINES.sub("\n\n", text)
+def page_text(page) -> bytes:
+    # Direct child path instead of a .//text descendant walk of the page
+    text_el = page.find("revision/text")
+    if text_el is None:
+        return b""
+    # Serialized straight from libxml2's UTF-8 buffer, no str round trip;
+    # cleaning and tokenization stay on bytes
+    return ET.tostring(text_el, encoding="utf-8", method="text", with_tail=False)
+
+def clean_wikitext(text: bytes) -> bytes:
+    # One pass deletes all markup. Newlines are collapsed afterwards, on the
+    # already shrunk text, so runs joined by a deleted template still merge.
+    text = RE_MARKUP.sub(b"", text)
+    text = RE_NEWLINES.sub(b"\n\n", text)
     return text.strip()
 
 # ======================
 # TOKENIZATION & IO
 # ======================
 
-def document_to_tokens(text: str) -> array.array:
-    # 1. Encode text to UTF-8 bytes
-    byte_vals = text.encode("utf-8")
-    
-    # 2. Convert bytes -> list of ints -> array of unsigned shorts ('H')
-    # This ensures 'H' treats them as numeric values (0-255), not raw memory.
-    tokens = array.array('H', list(byte_vals))
+def documents_to_tokens(texts: list[bytes]) -> bytes:
+    # The UTF-8 bytes are the tokens and EOS (0xFF) is just one more byte,
+    # so a whole block packs into its token stream with a single join.
+    # The trailing empty item puts an EOS after the last document too.
+    return bytes((EOS_TOKEN,)).join(texts + [b""])
+
+def save_checkpoint(block_idx: int, last_block_offset: int, tokens_bytes: int, hash_records: int):
+    # block_idx is the next block to process; last_block_offset is the dump
+    # byte offset of the last block written. tokens_bytes and hash_records
+    # are the committed lengths of tokens.bin and the hash log.
+    tmp_path = TOKENIZE_CHECKPOINT + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps({
+            "block_idx": block_idx,
+            "last_block_offset": last_block_offset,
+            "tokens_bytes": tokens_bytes,
+            "hash_records": hash_records
+        }))
+    # Atomic swap, so an interrupt mid-write never leaves a corrupt checkpoint
+    os.replace(tmp_path, TOKENIZE_CHECKPOINT)
+
+def load_checkpoint(offsets: np.ndarray) -> tuple[int, int | None, int | None]:
+    # Returns (start_block, tokens_bytes, hash_records); the lengths are None
+    # for older checkpoints that did not record them
+    if not os.path.exists(TOKENIZE_CHECKPOINT):
+        return 0, 0, 0
+    with open(TOKENIZE_CHECKPOINT, "rb") as f:
+        ckpt = orjson.loads(f.read())
+    # The dump byte offset stays valid even if the index is regenerated;
+    # older checkpoints only carry the block index
+    if "last_block_offset" in ckpt:
+        start_block = block_for_offset(offsets, ckpt["last_block_offset"]) + 1
+    else:
+        start_block = ckpt["block_idx"]
+    return start_block, ckpt.get("tokens_bytes"), ckpt.get("hash_records")
+
+def truncate_to_checkpoint(tokens_bytes: int, hash_records: int):
+    # Drop whatever reached disk after the last checkpoint: blocks that will
+    # be processed again, a torn partial block in tokens.bin, and hash
+    # records pointing at bytes that are about to be rewritten
+    if os.path.exists(TOKENS_FILE) and os.path.getsize(TOKENS_FILE) > tokens_bytes:
+        os.truncate(TOKENS_FILE, tokens_bytes)
+    if os.path.exists(HASHES_FILE) and os.path.getsize(HASHES_FILE) > 0:
+        header = read_hash_header(HASHES_FILE)
+        hashes_bytes = HASH_HEADER_DTYPE.itemsize + hash_records * HASH_DTYPE.itemsize
+        # Anything that is not a build log is left for open_hash_log to reject
+        if header is not None and header["magic"] == HASH_LOG_MAGIC and os.path.getsize(HASHES_FILE) > hashes_bytes:
+            os.truncate(HASHES_FILE, hashes_bytes)
+
+# ======================
+# HASH SIDECAR
+# ======================
+
+def cleaner_fingerprint() -> int:
+    # Identifies the cleaner behind a sidecar's cleaned bytes, so they are
+    # only ever reused by a build that would have produced the same bytes
+    engine = b"regex-recursive" if RECURSIVE_TEMPLATES else b"re"
+    return xxhash.xxh3_64_intdigest(b"\0".join((
+        str(CLEANER_VERSION).encode(), engine, RE_MARKUP.pattern, RE_NEWLINES.pattern
+    )))
+
+def read_hash_header(path: str):
+    header = np.fromfile(path, dtype=HASH_HEADER_DTYPE, count=1)
+    return header[0] if len(header) else None
+
+def write_hash_header(f, magic: bytes, count: int):
+    np.array([(magic, cleaner_fingerprint(), count)], dtype=HASH_HEADER_DTYPE).tofile(f)
+
+def open_hash_log(path: str):
+    # Append to the build log, refusing one written by a different cleaner
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        header = read_hash_header(path)
+        if header is None or header["magic"] != HASH_LOG_MAGIC:
+            raise ValueError(f"{path} is not a hash sidecar build log")
+        if header["cleaner"] != cleaner_fingerprint():
+            raise ValueError(f"{path} was written by a different cleaner; remove it and rebuild")
+        return open(path, "ab")
+    f = open(path, "wb")
+    write_hash_header(f, HASH_LOG_MAGIC, 0)
+    return f
+
+def finalize_hashes(path: str):
+    # Records are appended in dump order; sorting by hash once the build is
+    # complete lets the next dump look them up with a binary search
+    records = np.fromfile(path, dtype=HASH_DTYPE, offset=HASH_HEADER_DTYPE.itemsize)
+    records = records[np.argsort(records["h"], kind="stable")]
     
-    # 3. Append EOS (256), which fits in 'H' (0-65535) but not 'B' (0-255)
-    tokens.append(EOS_TOKEN)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write_hash_header(f, HASH_INDEX_MAGIC, len(records))
+        # Column-major, so the keys can be memmapped as one contiguous array
+        for field in HASH_DTYPE.names:
+            np.ascontiguousarray(records[field]).tofile(f)
+    # Atomic swap, so an interrupt never destroys the index of a finished build
+    os.replace(tmp_path, path)
+
+def load_prev_dump(tokens_path: str | None, hashes_path: str | None):
+    if not tokens_path or not hashes_path:
+        return None
+    header = read_hash_header(hashes_path)
+    if header is None or header["magic"] != HASH_INDEX_MAGIC:
+        raise ValueError(f"{hashes_path} is not a finished hash sidecar")
+    if header["cleaner"] != cleaner_fingerprint():
+        raise ValueError(f"{hashes_path} was built with a different cleaner; its tokens cannot be reused")
     
-    return tokens
+    # Memmapped columns are shared through the page cache by all workers
+    count = int(header["count"])
+    offset = HASH_HEADER_DTYPE.itemsize
+    columns = []
+    for name in HASH_DTYPE.names:
+        dtype = HASH_DTYPE.fields[name][0]
+        columns.append(np.memmap(hashes_path, dtype=dtype, mode="r", offset=offset, shape=(count,)) if count else np.empty(0, dtype=dtype))
+        offset += count * dtype.itemsize
+    keys, offs, lens = columns
+    return keys, offs, lens, np.memmap(tokens_path, dtype=np.uint8, mode="r")
 
-def save_checkpoint(block_idx: int):
-    with open(TOKENIZE_CHECKPOINT, "w") as f:
-        json.dump({"block_idx": block_idx}, f)
+def lookup_prev_dump(h: int) -> bytes | None:
+    if _prev_dump is None:
+        return None
+    keys, offs, lens, tokens = _prev_dump
+    i = int(np.searchsorted(keys, h))
+    if i == len(keys) or keys[i] != h:
+        return None
+    off, length = int(offs[i]), int(lens[i])
+    return tokens[off:off + length].tobytes()
 
-def load_checkpoint() -> int:
-    if not os.path.exists(TOKENIZE_CHECKPOINT):
-        return 0
-    with open(TOKENIZE_CHECKPOINT, "r") as f:
-        return json.load(f)["block_idx"]
+# ======================
+# WORKER
+# ======================
+
+_xml_file = None
+_offsets = None
+_prev_dump = None
+
+def init_worker(xml_path: str, offsets: np.ndarray, prev_tokens_path: str | None, prev_hashes_path: str | None):
+    # Each worker keeps its own handle on the dump for all of its blocks
+    global _xml_file, _offsets, _prev_dump
+    _xml_file = open(xml_path, "rb")
+    _offsets = offsets
+    _prev_dump = load_prev_dump(prev_tokens_path, prev_hashes_path)
+    if hasattr(os, "posix_fadvise"):
+        # Workers jump between blocks, so kernel readahead is replaced by the
+        # explicit per-block prefetch in process_block
+        os.posix_fadvise(_xml_file.fileno(), 0, 0, os.POSIX_FADV_RANDOM)
+
+def block_span(block_idx: int) -> tuple[int, int | None]:
+    # Compressed [start, end) of a block; the last one runs to EOF (None)
+    end = int(_offsets[block_idx + 1]) if block_idx + 1 < len(_offsets) else None
+    return int(_offsets[block_idx]), end
+
+def prefetch_block(block_idx: int):
+    # Ask the kernel to start reading a block that a worker will need soon
+    if not hasattr(os, "posix_fadvise") or block_idx >= len(_offsets):
+        return
+    offset, end = block_span(block_idx)
+    os.posix_fadvise(_xml_file.fileno(), offset, 0 if end is None else end - offset, os.POSIX_FADV_WILLNEED)
+
+def process_block(block_idx: int) -> tuple[int, bytes, np.ndarray]:
+    # Every multistream block is an independent bz2 stream, so a block can
+    # be decompressed, parsed, cleaned and tokenized without any shared state
+    prefetch_block(block_idx + PREFETCH_DISTANCE)
+    data, complete = read_block(_xml_file, *block_span(block_idx))
+    
+    texts = []
+    records = []
+    pos = 0 # Offset of the next document within this block's payload
+    for page in stream_pages(data, complete):
+        # Reject on metadata before touching the (much larger) text
+        if not is_valid_article(parse_page(page)):
+            continue
+        text = page_text(page)
+        if len(text) < MIN_ARTICLE_BYTES:
+            continue
+        # Cleaning is deterministic, so unchanged raw text can reuse the
+        # previous dump's cleaned bytes
+        h = xxhash.xxh3_64_intdigest(text)
+        cleaned = lookup_prev_dump(h)
+        if cleaned is None:
+            cleaned = clean_wikitext(text)
+        texts.append(cleaned)
+        records.append((h, pos, len(cleaned)))
+        pos += len(cleaned) + 1
+    return block_idx, documents_to_tokens(texts), np.array(records, dtype=HASH_DTYPE)
 
 # ======================
 # MAIN
@@ -148,40 +370,58 @@ def load_checkpoint() -> int:
 
 def build_token_cache():
     offsets = load_multistream_index(INDEX_PATH)
-    start_block = load_checkpoint()
+    start_block, tokens_bytes, hash_records = load_checkpoint(offsets)
+    if start_block >= len(offsets):
+        # An interrupted finalize leaves the sidecar as a log; finish it now
+        if os.path.exists(HASHES_FILE) and read_hash_header(HASHES_FILE)["magic"] == HASH_LOG_MAGIC:
+            finalize_hashes(HASHES_FILE)
+        print("[✓] Tokenization already complete")
+        return
     
-    # If resuming, we might have partial data for start_block in tokens.bin.
-    # Ideally, you'd truncate tokens.bin or increment start_block by 1.
-    # Here, we will just start processing.
+    # Blocks are written in order and tokens.bin and the hash log are
+    # flushed before each checkpoint, which records their lengths. Cutting
+    # both back to those lengths makes the resume exact: no repeated blocks,
+    # no torn block, no stale hash records.
+    if tokens_bytes is not None and hash_records is not None:
+        truncate_to_checkpoint(tokens_bytes, hash_records)
+    elif os.path.exists(HASHES_FILE) and os.path.getsize(HASHES_FILE) > 0:
+        # Older checkpoint without lengths: keep the files and count the log
+        hash_records = (os.path.getsize(HASHES_FILE) - HASH_HEADER_DTYPE.itemsize) // HASH_DTYPE.itemsize
+    else:
+        hash_records = 0
     
-    print(f"[+] Starting from block {start_block}/{len(offsets)}")
+    print(f"[+] Starting from block {start_block}/{len(offsets)} with {NUM_WORKERS} workers")
 
-    # Open with 'ab' (append binary)
-    with open(TOKENS_FILE, "ab") as fout:
-        
-        # We manually track index to handle the 'None' signal from generator
-        current_block_idx = start_block
-        
-        generator = stream_pages_multistream(XML_PATH, offsets, start_block)
+    if PREV_TOKENS_FILE and PREV_HASHES_FILE:
+        # Validate here so a mismatched sidecar fails before any work starts
+        load_prev_dump(PREV_TOKENS_FILE, PREV_HASHES_FILE)
+        print(f"[+] Reusing unchanged articles from {PREV_TOKENS_FILE}")
+    init_args = (XML_PATH, offsets, PREV_TOKENS_FILE, PREV_HASHES_FILE)
+
+    # Open with 'ab' (append binary) behind a large write buffer
+    with open(TOKENS_FILE, "ab", buffering=WRITE_BUFFER_SIZE) as fout, open_hash_log(HASHES_FILE) as fhashes, Pool(NUM_WORKERS, initializer=init_worker, initargs=init_args) as pool:
+        # imap hands back results in task order, so blocks land in tokens.bin
+        # in dump order even though workers finish them out of order
+        for block_idx, payload, records in pool.imap(process_block, range(start_block, len(offsets)), chunksize=IMAP_CHUNKSIZE):
+            # Worker offsets are relative to the block payload
+            records["off"] += fout.tell()
+            fout.write(payload)
+            records.tofile(fhashes)
+            hash_records += len(records)
+            
+            current_block_idx = block_idx + 1
+            if current_block_idx % 10 == 0:
+                fout.flush()
+                fhashes.flush()
+                save_checkpoint(current_block_idx, int(offsets[block_idx]), fout.tell(), hash_records)
+                print(f"[{current_block_idx}] Checkpoint saved.")
         
-        for item in generator:
-            # Check for End of Block signal
-            if item is None:
-                current_block_idx += 1
-                if current_block_idx % 10 == 0:
-                    save_checkpoint(current_block_idx)
-                    print(f"[{current_block_idx}] Checkpoint saved.")
-                continue
-
-            # Process Page
-            page = item
-            p = parse_page(page)
-            if is_valid_article(p):
-                text = clean_wikitext(p["text"])
-                tokens = document_to_tokens(text)
-                # Fast binary write using array
-                tokens.tofile(fout)
+        # Mark the whole dump done, so a rerun never appends to the index
+        fout.flush()
+        fhashes.flush()
+        save_checkpoint(len(offsets), int(offsets[-1]), fout.tell(), hash_records)
 
+    finalize_hashes(HASHES_FILE)
     print("[✓] Tokenization complete")
 
 if __name__ == "__main__":
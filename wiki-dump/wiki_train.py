@@ -1,8 +1,7 @@
-import struct
-import json
 import os
-import array
-from collections import deque
+import mmap
+import numpy as np
+import orjson
 from dotenv import load_dotenv
 load_dotenv()
 # ======================
@@ -15,34 +14,35 @@ TRAIN_CHECKPOINT = os.getenv("TRAIN_CHECKPOINT", "wiki-dump/train_checkpoint.jso
 
 CONTEXT_LEN = 256
 BATCH_SIZE = 32 # Added for realistic loop usage
-CHUNK_SIZE = 65536 * 2 # How many bytes to read from disk at once
+WINDOW_STRIDE = 1 # Tokens between window starts (CONTEXT_LEN = non-overlapping)
+TOKEN_DTYPE = np.uint8 # One byte per token, as written by wiki_tokenize.py
+CHECKPOINT_EVERY = 100 # Steps; a checkpoint is one tiny JSON file, so this is cheap
+LOG_EVERY = 1000 # Steps
 
 # ======================
 # CHECKPOINT
 # ======================
 
-def load_checkpoint():
+def load_checkpoint() -> int:
     if not os.path.exists(TRAIN_CHECKPOINT):
-        # file_offset (bytes), buffer (list of ints)
-        return 0, []
+        # file_offset (bytes) of the next window start
+        return 0
     
     try:
-        ckpt = json.load(open(TRAIN_CHECKPOINT))
-        return ckpt.get("file_offset", 0), ckpt.get("buffer", [])
-    except (json.JSONDecodeError, KeyError):
-        return 0, []
+        with open(TRAIN_CHECKPOINT, "rb") as f:
+            ckpt = orjson.loads(f.read())
+        return ckpt.get("file_offset", 0)
+    except (orjson.JSONDecodeError, KeyError):
+        return 0
 
-def save_checkpoint(file_offset: int, buffer: deque):
-    # We only save a small part of the buffer to keep JSON small
-    # Ideally, you shouldn't save the buffer in JSON for production, 
-    # but for this scale it is fine.
-    json.dump(
-        {
-            "file_offset": file_offset, 
-            "buffer": list(buffer)
-        },
-        open(TRAIN_CHECKPOINT, "w")
-    )
+def save_checkpoint(file_offset: int):
+    # The token file is memory-mapped, so the byte offset alone is enough
+    # to resume; there is no read-ahead buffer to persist.
+    tmp_path = TRAIN_CHECKPOINT + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps({"file_offset": file_offset}))
+    # Atomic swap, so an interrupt mid-write never leaves a corrupt checkpoint
+    os.replace(tmp_path, TRAIN_CHECKPOINT)
 
 # ======================
 # TRAINING STREAM
@@ -50,45 +50,35 @@ def save_checkpoint(file_offset: int, buffer: deque):
 
 def training_stream():
     # 1. Load state
-    file_offset, saved_buffer = load_checkpoint()
+    file_offset = load_checkpoint()
     
-    # Reconstruct deque
-    buffer = deque(saved_buffer)
+    # CONTEXT_LEN + 1 tokens are required for an x,y pair. Checked before
+    # mapping, since an empty file cannot be memory-mapped at all.
+    if os.path.getsize(TOKENS_FILE) < (CONTEXT_LEN + 1) * np.dtype(TOKEN_DTYPE).itemsize:
+        return
     
-    # 2. Open binary file
-    with open(TOKENS_FILE, "rb") as f:
-        # Fast Seek to where we left off
-        f.seek(file_offset)
-        print(f"[+] Resumed from byte offset: {file_offset}")
-
-        while True:
-            # Maintain buffer size (CONTEXT_LEN + 1 is min required for x,y pair)
-            while len(buffer) < CONTEXT_LEN + 1:
-                # Read raw bytes
-                chunk_bytes = f.read(CHUNK_SIZE)
-                if not chunk_bytes:
-                    return # End of dataset
-                
-                # Convert bytes -> Unsigned Shorts (H) -> Ints
-                # Matches array.array('H') from tokenization
-                new_tokens = array.array('H')
-                new_tokens.frombytes(chunk_bytes)
-                buffer.extend(new_tokens)
-                
-                # Update offset for next checkpoint
-                file_offset += len(chunk_bytes)
+    # 2. Map the flat token file; the OS page cache does the reading
+    mm = np.memmap(TOKENS_FILE, dtype=TOKEN_DTYPE, mode="r")
+    itemsize = mm.dtype.itemsize
+    if hasattr(mmap, "MADV_SEQUENTIAL"):
+        # Windows are read front to back: larger readahead, early eviction
+        mm._mmap.madvise(mmap.MADV_SEQUENTIAL)
+    
+    # (num_windows, CONTEXT_LEN + 1) strided view over the memmap, no copies
+    windows = np.lib.stride_tricks.sliding_window_view(mm, CONTEXT_LEN + 1)
+    
+    # Fast Seek to where we left off
+    pos = file_offset // itemsize
+    print(f"[+] Resumed from byte offset: {file_offset}")
 
-            # Yield one sample
-            # (In production, you would batch this logic)
-            seq = [buffer[i] for i in range(CONTEXT_LEN + 1)]
-            
-            # Remove only the first token to slide the window
-            buffer.popleft()
-            
-            x = seq[:-1]
-            y = seq[1:]
-            
-            yield x, y, file_offset, buffer
+    step = BATCH_SIZE * WINDOW_STRIDE
+    while pos < len(windows):
+        # (BATCH_SIZE, CONTEXT_LEN + 1) view; the last batch may be shorter
+        batch = windows[pos:pos + step:WINDOW_STRIDE]
+        
+        pos += step
+        
+        yield batch[:, :-1], batch[:, 1:], pos * itemsize
 
 # ======================
 # EXAMPLE RUN
@@ -101,20 +91,23 @@ if __name__ == "__main__":
         stream = training_stream()
         
         # Simulate training loop
-        for step, (x, y, offset, buffer) in enumerate(stream):
+        for step, (x, y, offset) in enumerate(stream):
             
             # Print first batch only to verify data looks correct
             if step == 0:
-                print(f"Sample X (first 10): {x[:10]}")
-                print(f"Sample Y (first 10): {y[:10]}")
+                print(f"Batch shape: {x.shape}")
+                print(f"Sample X (first 10): {x[0, :10].tolist()}")
+                print(f"Sample Y (first 10): {y[0, :10].tolist()}")
 
-            if step % 1000 == 0:
+            if step % LOG_EVERY == 0:
                 print(f"Step {step} | Offset {offset} bytes")
-                save_checkpoint(offset, buffer)
+
+            if step % CHECKPOINT_EVERY == 0:
+                save_checkpoint(offset)
 
             # 🔥 Optimizer step here
 
     except KeyboardInterrupt:
         print("\n[!] Interrupted — Checkpoint saved.")
         # Save exact state on exit
-        save_checkpoint(offset, buffer)
\ No newline at end of file
+        save_checkpoint(offset)
\ No newline at end of file